@@ -1,31 +1,42 @@
 import sys
+import asyncio
+import atexit
+import html
 import json
 import base64
+import hashlib
 import os
+import re
 import shutil
 import tempfile
+import threading
 from io import BytesIO
 from typing import List
 
+# orjson（Rust 实现）解析长 JSON 明显更快；没装就退回标准库
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# 剥掉模型返回内容外层的 ``` / ```json 代码围栏
+_FENCE_RE = re.compile(r'^```(?:json)?\s*|\s*```$', re.M)
+
 # PyQt5 模块
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QPushButton, QTextEdit, QLabel, 
                              QFileDialog, QListWidget, QSplitter, QProgressBar,
                              QLineEdit, QFormLayout, QMessageBox, QTabWidget,
-                             QSizePolicy, QGroupBox, QProgressDialog)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
-from PyQt5.QtGui import QFont, QColor
+                             QSizePolicy, QGroupBox)
+from PyQt5.QtCore import (Qt, QObject, QRunnable, QThread,
+                          QThreadPool, pyqtSignal)
+from PyQt5.QtGui import QFont, QColor, QImage
 
 # 图像处理模块
+# 注意：cv2/pdf2image/openai/docx 都很重，全部延迟到首次使用时再导入，
+# 否则窗口首绘要多等几百毫秒（PyInstaller 解包环境下更明显）
 from PIL import Image
-from pdf2image import convert_from_path
-from openai import OpenAI
-
-# Word 操作模块
-from docx import Document
-from docx.shared import Pt, RGBColor, Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml.ns import qn
 
 # ==========================================
 # 工具函数：获取 Poppler 路径 (新增)
@@ -49,7 +60,9 @@ RUBRIC_PROMPT = """
 你是一位资深的高考英语阅卷专家。请对上传的手写英语作文图片进行识别、分类、评分，并提供极度详细的逐句修改意见。
 注意：图片可能包含试卷的题干或表格，请只提取并批改学生手写的作文部分。
 
-请严格按照以下 JSON 格式返回：
+本次可能一次上传多张作文图片：请按上传顺序逐一批改，并返回一个 JSON 数组，
+数组第 i 个元素是第 i 张图片的批改结果；即使只有一张图片，也返回仅含一个元素的数组。
+数组中每个元素严格按照以下 JSON 格式：
 {
     "recognized_text": "识别出的原文...",
     "essay_type": "应用文/读后续写",
@@ -82,79 +95,339 @@ RUBRIC_PROMPT = """
 """
 
 # ==========================================
-# 后端工作线程 (保持不变)
+# 精批页 HTML 模板（骨架是静态的，预编译成常量，切标签时只格式化动态字段）
 # ==========================================
-class Worker(QThread):
-    finished = pyqtSignal(dict, str)
-    error = pyqtSignal(str, str)
+_FEEDBACK_HEADER = """
+<h2 style='color:#333'>总分：<span style='color:#E53935; font-size:24px'>{total}/15</span></h2>
+<table border='1' cellpadding='6' cellspacing='0' style='border-collapse:collapse; width:100%; border-color:#ddd;'>
+    <tr style='background-color:#f5f5f5'>
+        <th width='33%'>内容要点</th><th width='33%'>语言表达</th><th width='33%'>结构衔接</th>
+    </tr>
+    <tr>
+        <td align='center'>{dim1}/5</td>
+        <td align='center'>{dim2}/5</td>
+        <td align='center'>{dim3}/5</td>
+    </tr>
+</table>
+<h3 style='background-color:#E3F2FD'>一、内容要点</h3>
+<ul>
+    <li><b>🔻 不足：</b> {weakness}</li>
+    <li><b>💡 建议：</b> {suggestion}</li>
+</ul>
+<h3 style='background-color:#FFF3E0'>二、语言表达 (逐句精改)</h3>
+"""
 
-    def __init__(self, file_path, api_key, model_endpoint):
-        super().__init__()
-        self.file_path = file_path
-        self.api_key = api_key
-        self.model_endpoint = model_endpoint 
+_CORRECTION_TEMPLATE = """
+<div style='margin-bottom:10px; border-bottom:1px dashed #ccc; padding-bottom:5px;'>
+    <p><b>{idx}. 🔴 原句：</b> <span style='color:#555'>{original}</span></p>
+    <p><b>🟢 修改：</b> <span style='color:#2E7D32; font-weight:bold'>{revised}</span></p>
+    <p><b>📘 解析：</b> <span style='color:#1565C0'>{explanation}</span></p>
+</div>
+"""
+
+_FEEDBACK_FOOTER = """
+<h3 style='background-color:#E8F5E9'>三、结构与衔接</h3>
+<p>{structure}</p>
+<hr>
+<p><b>🌟 整体总结：</b> {overall_summary}</p>
+"""
+
+# ==========================================
+# 批改结果缓存目录（跨会话持久化，LLM 调用是大头，重复图片直接命中）
+# ==========================================
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'essay_grader_cache')
 
-    def encode_image(self, image_path):
+# ==========================================
+# 后端工作线程 (asyncio 并发版)
+# 整个批次只占一个后台线程：线程里跑 asyncio 事件循环，
+# 用 AsyncOpenAI + Semaphore 做请求扇出，比每文件一个 OS 线程轻得多
+# ==========================================
+class GradingWorker(QThread):
+    file_finished = pyqtSignal(dict, str)
+    file_error = pyqtSignal(str, str)
+    file_skipped = pyqtSignal(str)
+    progress = pyqtSignal(str, int)  # (文件路径, 已接收片段数)
+
+    MAX_CONCURRENCY = 8
+    BATCH_SIZE = 4  # 每个请求合并的作文数
+
+    def __init__(self, tasks, api_key, model_endpoint, stop_check=None, parent=None):
+        super().__init__(parent)
+        # tasks: [(文件路径, 内存中的 PIL 图像或 None), ...]
+        self.tasks = tasks
+        self.api_key = api_key
+        self.model_endpoint = model_endpoint
+        # stop_check: 无参回调，返回 True 表示用户已请求停止
+        self.stop_check = stop_check or (lambda: False)
+        # 已经发出过终态信号（完成/失败/跳过）的路径
+        self._settled = set()
+
+    def _cache_path(self, file_path):
+        """按 图片内容 + 接入点 + 评分提示词 求哈希，提示词一改缓存自动失效"""
+        h = hashlib.sha256()
+        with open(file_path, 'rb') as fh:
+            h.update(fh.read())
+        h.update(self.model_endpoint.encode())
+        h.update(RUBRIC_PROMPT.encode())
+        return os.path.join(CACHE_DIR, h.hexdigest() + '.json')
+
+    def encode_image(self, image_path, pil_image=None):
         try:
-            img = Image.open(image_path)
-            if img is None: raise Exception("无法加载文件")
-            if img.mode in ("RGBA", "P"): img = img.convert("RGB")
-            
             max_size = 2048
-            if max(img.size) > max_size:
-                img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
 
-            buffered = BytesIO()
-            img.save(buffered, format="JPEG", quality=85)
-            return base64.b64encode(buffered.getvalue()).decode('utf-8')
+            # 快路径：已经是 2048px 以内的小 JPEG 就直接 base64 原始字节，
+            # 整条 解码->缩放->再编码 管线都省掉（手机照片常见情形）
+            if pil_image is None and image_path.lower().endswith(('.jpg', '.jpeg')):
+                with open(image_path, 'rb') as fh:
+                    raw = fh.read()
+                if len(raw) < 4_000_000:
+                    # Image.open 只读文件头取尺寸，不解码像素
+                    if max(Image.open(BytesIO(raw)).size) <= max_size:
+                        return base64.b64encode(raw).decode('ascii')
+
+            if pil_image is not None:
+                # 管线融合：PDF 页解析时已留在内存里，省一次 JPEG 编码 + 解码
+                img = pil_image
+            else:
+                img = Image.open(image_path)
+                if img is None: raise Exception("无法加载文件")
+                # JPEG 走 draft 模式：libjpeg 直接从 DCT 系数解出缩小图，省掉全分辨率解码
+                if img.format == 'JPEG':
+                    img.draft('RGB', (max_size, max_size))
+            # cv2 编码那里假定三通道：灰度(L)出 2 维数组、CMYK 出 4 通道，
+            # 都会让 imencode 挂掉，所以非 RGB 一律先转
+            if img.mode != "RGB": img = img.convert("RGB")
+
+            if max(img.size) > max_size:
+                # draft 已经完成粗降采样，剩余缩放用双三次即可，无需 LANCZOS 超采样
+                img.thumbnail((max_size, max_size), Image.Resampling.BICUBIC)
+
+            # 编码走 OpenCV：imencode 出 JPEG 字节比 Pillow 的 save 快不少
+            import cv2
+            import numpy as np
+            arr = np.asarray(img)[:, :, ::-1]  # RGB -> BGR
+            ok, buf = cv2.imencode('.jpg', arr, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            if not ok: raise Exception("JPEG 编码失败")
+            # b64encode 直接吃 buf 的缓冲区，不必 tobytes() 复制一份；
+            # base64 输出只有 ASCII，按 ascii 解码更快
+            return base64.b64encode(buf).decode('ascii')
         except Exception as e:
             raise Exception(f"文件预处理失败: {str(e)}")
 
     def run(self):
         try:
-            base64_image = self.encode_image(self.file_path)
-            # 注意：这里的 base_url 是针对火山引擎的，请确保正确
-            client = OpenAI(api_key=self.api_key, base_url="https://ark.cn-beijing.volces.com/api/v3")
-            
-            response = client.chat.completions.create(
-                model=self.model_endpoint,
-                messages=[
-                    {"role": "system", "content": RUBRIC_PROMPT},
-                    {"role": "user", "content": [{"type": "text", "text": "批改此作文并返回JSON。"}, 
-                                                 {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}]}
-                ],
-                temperature=0.2
-            )
-            content = response.choices[0].message.content.replace("```json", "").replace("```", "").strip()
-            if content.startswith("json"): content = content[4:]
-            
-            result_json = json.loads(content)
-            self.finished.emit(result_json, self.file_path)
+            asyncio.run(self._grade_all())
+        except Exception as e:
+            # 事件循环级别的失败（比如 openai 导入不了、客户端构建抛异常）
+            # 也必须逐一报 error，否则 GUI 的完成计数永远凑不满，按钮全锁死
+            for file_path, _pil in self.tasks:
+                if file_path not in self._settled:
+                    self.file_error.emit(str(e), file_path)
+
+    async def _grade_all(self):
+        from openai import AsyncOpenAI
+
+        # 客户端建一次：TLS 握手一次，之后都走 httpx 连接池的长连接
+        # 注意：这里的 base_url 是针对火山引擎的，请确保正确
+        client = AsyncOpenAI(api_key=self.api_key,
+                             base_url="https://ark.cn-beijing.volces.com/api/v3")
+        sem = asyncio.Semaphore(self.MAX_CONCURRENCY)
+
+        # 先过一遍本地缓存：命中的直接出结果，剩下的按 BATCH_SIZE 张一组
+        # 合并成单个多图请求 —— 系统提示词的 token 和一次 HTTP 往返都被摊薄
+        pending = []
+        for file_path, pil_image in self.tasks:
+            try:
+                cache_path = self._cache_path(file_path)
+            except Exception:
+                # 连缓存键都算不出来（文件读不了等），只好放弃该文件的缓存
+                cache_path = None
+            if cache_path and os.path.exists(cache_path):
+                try:
+                    with open(cache_path, 'r', encoding='utf-8') as fh:
+                        result = json.load(fh)
+                    self._settled.add(file_path)
+                    self.file_finished.emit(result, file_path)
+                    continue
+                except Exception:
+                    # 缓存条目损坏：删掉坏文件、保留 cache_path，
+                    # 重批成功后新结果会写回同一位置完成自愈
+                    try:
+                        os.remove(cache_path)
+                    except OSError:
+                        pass
+            pending.append((file_path, pil_image, cache_path))
+
+        groups = [pending[i:i + self.BATCH_SIZE]
+                  for i in range(0, len(pending), self.BATCH_SIZE)]
+        try:
+            await asyncio.gather(*(self._grade_group(client, sem, group)
+                                   for group in groups))
+        finally:
+            await client.close()
+
+    async def _grade_group(self, client, sem, group):
+        async with sem:
+            # 用户点了停止：还没开跑的分组直接放弃，不再发起 API 请求
+            if self.stop_check():
+                for file_path, _pil, _cache in group:
+                    self._settled.add(file_path)
+                    self.file_skipped.emit(file_path)
+                return
+            try:
+                # 图像预处理是 CPU 活，丢到线程池做，别阻塞事件循环。
+                # return_exceptions=True：一张坏图只报废它自己，
+                # 其余文件照常组批 —— 否则坏图会把整组永远拖下水
+                encoded = await asyncio.gather(
+                    *(asyncio.to_thread(self.encode_image, path, pil)
+                      for path, pil, _cache in group),
+                    return_exceptions=True)
+
+                good = []
+                for (file_path, _pil, cache_path), b64 in zip(group, encoded):
+                    if isinstance(b64, BaseException):
+                        self._settled.add(file_path)
+                        self.file_error.emit(str(b64), file_path)
+                    else:
+                        good.append((file_path, cache_path, b64))
+                if not good:
+                    return
+
+                user_content = [{"type": "text",
+                                 "text": f"以下共 {len(good)} 篇作文图片，请按上传顺序逐一批改，"
+                                         f"返回一个 JSON 数组，第 i 个元素是第 i 篇的批改结果（格式见系统提示）。"}]
+                user_content += [{"type": "image_url",
+                                  "image_url": {"url": f"data:image/jpeg;base64,{b64}"}}
+                                 for _path, _cache, b64 in good]
+
+                # 流式接收：边收边报进度，10-30 秒的 LLM 调用不再像卡死一样
+                response = await client.chat.completions.create(
+                    model=self.model_endpoint,
+                    messages=[
+                        {"role": "system", "content": RUBRIC_PROMPT},
+                        {"role": "user", "content": user_content}
+                    ],
+                    temperature=0.2,
+                    stream=True
+                )
+                chunks = []
+                first_path = good[0][0]
+                async for chunk in response:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    chunks.append(delta or '')
+                    self.progress.emit(first_path, len(chunks))
+
+                content = _FENCE_RE.sub('', "".join(chunks)).strip()
+
+                results = _loads(content)
+                # 单图时模型可能直接返回对象而非数组，统一成列表
+                if isinstance(results, dict):
+                    results = [results]
+                if len(results) != len(good):
+                    raise Exception(f"返回结果数 {len(results)} 与图片数 {len(good)} 不符")
+
+                for (file_path, cache_path, _b64), result_json in zip(good, results):
+                    # 写入缓存（尽力而为，写失败不影响本次结果）
+                    try:
+                        if cache_path:
+                            os.makedirs(CACHE_DIR, exist_ok=True)
+                            with open(cache_path, 'w', encoding='utf-8') as fh:
+                                json.dump(result_json, fh, ensure_ascii=False)
+                    except OSError:
+                        pass
+                    self._settled.add(file_path)
+                    self.file_finished.emit(result_json, file_path)
+            except Exception as e:
+                # 预处理阶段已经单独报过错的文件不再重复发信号
+                for file_path, _pil, _cache in group:
+                    if file_path in self._settled:
+                        continue
+                    self._settled.add(file_path)
+                    self.file_error.emit(str(e), file_path)
+
+# ==========================================
+# PDF 后台导入（QThreadPool）
+# ==========================================
+class PdfImportSignals(QObject):
+    """QRunnable 不是 QObject，信号挂在单独的发射器上"""
+    page_ready = pyqtSignal(str, str, object)  # (显示名, 临时路径, 内存中的 PIL 页)
+    failed = pyqtSignal(str, str)              # (文件名, 错误信息)
+    done = pyqtSignal(str)                     # 文件名
+
+
+class PdfImportWorker(QRunnable):
+    """单个 PDF 的光栅化、降采样、落盘全在池线程里完成，GUI 只收信号"""
+
+    def __init__(self, pdf_path, temp_dir):
+        super().__init__()
+        self.pdf_path = pdf_path
+        self.temp_dir = temp_dir
+        self.signals = PdfImportSignals()
+
+    def run(self):
+        from pdf2image import convert_from_path
+
+        filename = os.path.basename(self.pdf_path)
+        try:
+            # === 修改点：使用 get_poppler_path() 传入正确的路径 ===
+            poppler_bin = get_poppler_path()
+            # 多线程光栅化；页面留在内存直接交给批改管线（管线融合），
+            # 磁盘 JPEG 只作为列表键 / 缓存键的副本
+            pages = convert_from_path(self.pdf_path, poppler_path=poppler_bin,
+                                      thread_count=os.cpu_count() or 4)
+
+            for i, page in enumerate(pages):
+                page_filename = f"{os.path.splitext(filename)[0]}_Page_{i+1}.jpg"
+                temp_path = os.path.join(self.temp_dir, page_filename)
+                page.thumbnail((2048, 2048), Image.Resampling.BICUBIC)
+                if page.mode != 'RGB':
+                    page = page.convert('RGB')
+                # 落盘走 Qt 的 C++ JPEG 编码器，比 PIL 的 save 快
+                raw = page.tobytes('raw', 'RGB')
+                qimg = QImage(raw, page.width, page.height,
+                              page.width * 3, QImage.Format_RGB888)
+                qimg.save(temp_path, 'JPEG', 85)
+                self.signals.page_ready.emit(f"[PDF P{i+1}] {filename}", temp_path, page)
+            self.signals.done.emit(filename)
         except Exception as e:
-            self.error.emit(str(e), self.file_path)
+            self.signals.failed.emit(filename, str(e))
 
 # ==========================================
 # 前端 GUI
 # ==========================================
 class EssayGraderApp(QMainWindow):
+    # 列表项着色用的颜色常量：按名字构造 QColor 每次都要查 SVG 颜色表，提前建好
+    _COLOR_OK = QColor(0, 128, 0)
+    _COLOR_ERR = QColor(229, 57, 53)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("英语作文智能批改系统（请接入豆包模型）")
         self.resize(1400, 900)
         
-        self.results_store = {} 
+        self.results_store = {}
+        # file_list 中已有路径的镜像，加文件去重走 O(1) 查找而非遍历 Qt 列表
+        self._file_paths = set()
+        # PDF 页的内存缓存 {临时文件路径: PIL.Image}，批改时免去重新解码
+        self.pdf_cache = {}
         self.temp_dir = tempfile.mkdtemp(prefix="essay_grader_")
-        
+        # 正在后台解析的 PDF 数
+        self._pdf_imports_active = 0
+        # 兜底清理：即使窗口没有正常走 closeEvent，进程退出时也尝试删除
+        atexit.register(shutil.rmtree, self.temp_dir, ignore_errors=True)
+
         # --- 新增标志位：是否请求停止 ---
         self.stop_requested = False 
         
         self.init_ui()
 
     def closeEvent(self, event):
-        try:
-            shutil.rmtree(self.temp_dir)
-        except:
-            pass
+        # 删除放到后台守护线程：几百页 PDF 的临时 JPEG 不再拖慢退出
+        threading.Thread(target=shutil.rmtree, args=(self.temp_dir,),
+                         kwargs={'ignore_errors': True}, daemon=True).start()
+        # 守护线程已接手，撤销 atexit 兜底——否则解释器退出时
+        # 又会同步跑一遍 rmtree，把省下的退出延迟全吐回去
+        atexit.unregister(shutil.rmtree)
         event.accept()
 
     def init_ui(self):
@@ -274,55 +547,63 @@ class EssayGraderApp(QMainWindow):
     def add_files(self):
         filters = "All Support (*.png *.jpg *.jpeg *.pdf);;Images (*.png *.jpg);;PDF (*.pdf)"
         files, _ = QFileDialog.getOpenFileNames(self, "选择文件", "", filters)
-        
+
         if not files: return
 
-        progress = QProgressDialog("正在解析文件...", "取消", 0, len(files), self)
-        progress.setWindowModality(Qt.WindowModal)
-        
-        count = 0
         for f in files:
-            if progress.wasCanceled(): break
-            
             ext = os.path.splitext(f)[1].lower()
             filename = os.path.basename(f)
-            
+
             if ext == '.pdf':
-                try:
-                    self.status_label.setText(f"正在拆分 PDF: {filename}...")
-                    QApplication.processEvents()
-                    
-                    # === 修改点：使用 get_poppler_path() 传入正确的路径 ===
-                    poppler_bin = get_poppler_path()
-                    pages = convert_from_path(f, poppler_path=poppler_bin)
-                    
-                    for i, page in enumerate(pages):
-                        page_filename = f"{os.path.splitext(filename)[0]}_Page_{i+1}.jpg"
-                        temp_path = os.path.join(self.temp_dir, page_filename)
-                        page.save(temp_path, "JPEG")
-                        display_name = f"[PDF P{i+1}] {filename}"
-                        self.add_item_to_list(display_name, temp_path)
-                except Exception as e:
-                    QMessageBox.warning(self, "转换失败", f"无法解析 PDF {filename}:\n请确保 Poppler 已安装。\n错误信息: {str(e)}")
+                # PDF 解析扔进线程池：GUI 线程只收信号，不再 processEvents() 硬撑
+                worker = PdfImportWorker(f, self.temp_dir)
+                worker.signals.page_ready.connect(self.on_pdf_page_ready)
+                worker.signals.failed.connect(self.on_pdf_failed)
+                worker.signals.done.connect(self.on_pdf_done)
+                self._pdf_imports_active += 1
+                QThreadPool.globalInstance().start(worker)
             else:
                 self.add_item_to_list(filename, f)
-            
-            count += 1
-            progress.setValue(count)
-        
-        self.status_label.setText(f"添加完成")
+
+        if self._pdf_imports_active > 0:
+            self.status_label.setText(f"后台解析 {self._pdf_imports_active} 个 PDF...")
+        else:
+            self.status_label.setText("添加完成")
+
+    # --- PDF 后台导入的槽函数 ---
+    def on_pdf_page_ready(self, display_name, temp_path, page):
+        self.pdf_cache[temp_path] = page
+        self.add_item_to_list(display_name, temp_path)
+
+    def _pdf_import_finished(self):
+        """成功或失败都走这里：计数减一并刷新状态栏"""
+        self._pdf_imports_active -= 1
+        if self._pdf_imports_active == 0:
+            self.status_label.setText("添加完成")
+        else:
+            self.status_label.setText(f"后台解析 {self._pdf_imports_active} 个 PDF...")
+
+    def on_pdf_done(self, filename):
+        self._pdf_import_finished()
+
+    def on_pdf_failed(self, filename, err):
+        self._pdf_import_finished()
+        QMessageBox.warning(self, "转换失败", f"无法解析 PDF {filename}:\n请确保 Poppler 已安装。\n错误信息: {err}")
 
     def add_item_to_list(self, display_name, file_path):
-        items = [self.file_list.item(x).data(Qt.UserRole) for x in range(self.file_list.count())]
-        if file_path not in items:
-            list_item = self.file_list.addItem(display_name)
-            self.file_list.item(self.file_list.count()-1).setData(Qt.UserRole, file_path)
+        if file_path in self._file_paths:
+            return
+        self._file_paths.add(file_path)
+        self.file_list.addItem(display_name)
+        self.file_list.item(self.file_list.count()-1).setData(Qt.UserRole, file_path)
 
     def delete_selected(self):
         row = self.file_list.currentRow()
         if row >= 0:
             item = self.file_list.takeItem(row)
             file_path = item.data(Qt.UserRole)
+            self._file_paths.discard(file_path)
+            self.pdf_cache.pop(file_path, None)
             if file_path in self.results_store:
                 del self.results_store[file_path]
             self.refresh_ui_state()
@@ -333,6 +614,8 @@ class EssayGraderApp(QMainWindow):
                                          QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
             if reply == QMessageBox.Yes:
                 self.file_list.clear()
+                self._file_paths.clear()
+                self.pdf_cache.clear()
                 self.results_store.clear()
                 self.refresh_ui_state()
                 self.progress_bar.setValue(0)
@@ -352,6 +635,12 @@ class EssayGraderApp(QMainWindow):
 
     def start_grading(self):
         if self.file_list.count() == 0: return
+        # PDF 还在后台解析时先别开批：快照之后才到达的页面会被漏掉
+        if self._pdf_imports_active > 0:
+            QMessageBox.warning(self, "提示",
+                                f"还有 {self._pdf_imports_active} 个 PDF 在后台解析，"
+                                f"请等待解析完成后再开始批改")
+            return
         api_key = self.api_key_input.text().strip()
         endpoint = self.endpoint_input.text().strip()
         if not api_key or not endpoint:
@@ -367,69 +656,109 @@ class EssayGraderApp(QMainWindow):
         self.btn_clear.setEnabled(False)
         self.btn_add.setEnabled(False)
         
-        # 从头开始，或者继续未完成的？这里简化逻辑：总是从头寻找第一个未批改的
-        self.process_next_file(0, api_key, endpoint)
-
-    # --- 新增功能：停止按钮槽函数 ---
-    def stop_grading_process(self):
-        self.stop_requested = True
-        self.btn_stop.setEnabled(False) # 防止重复点击
-        self.status_label.setText("⚠️ 正在停止... 当前任务完成后将中止")
+        # 收集所有尚未批改的文件，一次性全部扔进线程池并发处理
+        pending = []
+        self._path_to_row = {}
+        for index in range(self.file_list.count()):
+            item = self.file_list.item(index)
+            file_path = item.data(Qt.UserRole)
+            self._path_to_row[file_path] = index
+            if file_path not in self.results_store:
+                pending.append(file_path)
 
-    def process_next_file(self, index, api_key, endpoint):
-        # 1. 检查是否越界
-        if index >= self.file_list.count():
+        if not pending:
             self.finish_grading_session("所有文件批改完成")
             return
 
-        item = self.file_list.item(index)
-        file_path = item.data(Qt.UserRole)
-        display_name = item.text()
-        
-        # 2. 如果已经批改过，跳过
-        if file_path in self.results_store:
-            self.process_next_file(index + 1, api_key, endpoint)
-            return
+        # 同批次内容去重：完全相同的图片（误复制/重复导入）只调用一次 LLM，
+        # 其余路径在首个结果返回时直接复用
+        self._dup_map = {}
+        hash_to_primary = {}
+        scheduled = []
+        for file_path in pending:
+            try:
+                with open(file_path, 'rb') as fh:
+                    digest = hashlib.sha1(fh.read()).hexdigest()
+            except OSError:
+                scheduled.append(file_path)
+                continue
+            primary = hash_to_primary.get(digest)
+            if primary is None:
+                hash_to_primary[digest] = file_path
+                scheduled.append(file_path)
+            else:
+                self._dup_map.setdefault(primary, []).append(file_path)
+
+        # 完成计数：槽函数都在 GUI 线程串行执行，普通 int 即可
+        self._total_tasks = len(pending)
+        self._done_tasks = 0
+        self.progress_bar.setValue(0)
+        self.status_label.setText(f"并发批改中... 共 {self._total_tasks} 份")
+
+        # 全部任务交给单个后台线程里的 asyncio 事件循环扇出
+        tasks = [(p, self.pdf_cache.get(p)) for p in scheduled]
+        self._grading_worker = GradingWorker(tasks, api_key, endpoint,
+                                             stop_check=lambda: self.stop_requested)
+        self._grading_worker.file_finished.connect(self.on_result)
+        self._grading_worker.file_error.connect(self.on_error)
+        self._grading_worker.file_skipped.connect(self.on_skipped)
+        self._grading_worker.progress.connect(self.on_progress)
+        self._grading_worker.start()
 
-        # 3. 开始处理当前文件
-        self.file_list.setCurrentRow(index)
-        self.status_label.setText(f"正在处理: {display_name}")
-        self.progress_bar.setValue(int((index / self.file_list.count()) * 100))
+    # --- 新增功能：停止按钮槽函数 ---
+    def stop_grading_process(self):
+        self.stop_requested = True
+        self.btn_stop.setEnabled(False) # 防止重复点击
+        self.status_label.setText("⚠️ 正在停止... 进行中的任务完成后将中止")
+
+    def _check_session_done(self):
+        """每个任务结束（成功/失败/跳过）后调用，全部完成则收尾"""
+        self._done_tasks += 1
+        self.progress_bar.setValue(int((self._done_tasks / self._total_tasks) * 100))
+        if self._done_tasks >= self._total_tasks:
+            if self.stop_requested:
+                self.finish_grading_session(f"已停止。已批改 {len(self.results_store)} 份文件。")
+            else:
+                self.finish_grading_session("所有文件批改完成")
 
-        self.worker = Worker(file_path, api_key, endpoint)
-        self.worker.finished.connect(lambda res, path: self.on_result(res, path, index, api_key, endpoint))
-        self.worker.error.connect(lambda err, path: self.on_error(err, path, index, api_key, endpoint))
-        self.worker.start()
+    def _mark_item(self, file_path, prefix, color):
+        item = self.file_list.item(self._path_to_row[file_path])
+        original_text = item.text()
+        if not original_text.startswith(prefix):
+            item.setText(f"{prefix} {original_text}")
+        item.setForeground(color)
 
-    def on_result(self, result, file_path, index, api_key, endpoint):
+    def on_result(self, result, file_path):
         # 保存结果
         self.results_store[file_path] = result
-        item = self.file_list.item(index)
-        original_text = item.text()
-        if not original_text.startswith("✅"):
-            item.setText(f"✅ {original_text}")
-        item.setForeground(QColor("green"))
+        self._mark_item(file_path, "✅", self._COLOR_OK)
         self.display_result(result)
-        
-        # --- 关键修改：检查停止标志 ---
-        if self.stop_requested:
-            self.finish_grading_session(f"已停止。已批改 {len(self.results_store)} 份文件。")
-        else:
-            self.process_next_file(index + 1, api_key, endpoint)
-
-    def on_error(self, err, file_path, index, api_key, endpoint):
+        self._check_session_done()
+        # 同内容的重复文件直接复用本次结果
+        for dup_path in self._dup_map.get(file_path, []):
+            self.results_store[dup_path] = result
+            self._mark_item(dup_path, "✅", self._COLOR_OK)
+            self._check_session_done()
+
+    def on_error(self, err, file_path):
         self.status_label.setText(f"错误: {err}")
-        item = self.file_list.item(index)
-        original_text = item.text()
-        if not original_text.startswith("❌"):
-            item.setText(f"❌ {original_text}")
-        item.setForeground(QColor("red"))
-        
-        # --- 关键修改：检查停止标志 ---
-        if self.stop_requested:
-            self.finish_grading_session("已停止（发生错误后中断）。")
-        else:
-            self.process_next_file(index + 1, api_key, endpoint)
+        self._mark_item(file_path, "❌", self._COLOR_ERR)
+        self._check_session_done()
+        # 重复文件也一并标记失败（下次批改会重试）
+        for dup_path in self._dup_map.get(file_path, []):
+            self._mark_item(dup_path, "❌", self._COLOR_ERR)
+            self._check_session_done()
+
+    def on_skipped(self, file_path):
+        # 用户停止后被放弃的排队任务，不改变列表项状态
+        self._check_session_done()
+        for _dup_path in self._dup_map.get(file_path, []):
+            self._check_session_done()
+
+    def on_progress(self, file_path, n_chunks):
+        if not self.stop_requested:
+            self.status_label.setText(
+                f"接收中: {os.path.basename(file_path)} (已收到 {n_chunks} 个片段)")
 
     def finish_grading_session(self, message):
         """批改会话结束（无论是完成还是停止）后的清理工作"""
@@ -466,46 +795,33 @@ class EssayGraderApp(QMainWindow):
         fb = data.get('feedback_detail', {})
         content_fb = fb.get('content', {})
         lang_fb = fb.get('language', {})
-        
-        html = f"""
-        <h2 style='color:#333'>总分：<span style='color:#E53935; font-size:24px'>{scores.get('total', 0)}/15</span></h2>
-        <table border='1' cellpadding='6' cellspacing='0' style='border-collapse:collapse; width:100%; border-color:#ddd;'>
-            <tr style='background-color:#f5f5f5'>
-                <th width='33%'>内容要点</th><th width='33%'>语言表达</th><th width='33%'>结构衔接</th>
-            </tr>
-            <tr>
-                <td align='center'>{scores.get('dim1_score', 0)}/5</td>
-                <td align='center'>{scores.get('dim2_score', 0)}/5</td>
-                <td align='center'>{scores.get('dim3_score', 0)}/5</td>
-            </tr>
-        </table>
-        <h3 style='background-color:#E3F2FD'>一、内容要点</h3>
-        <ul>
-            <li><b>🔻 不足：</b> {content_fb.get('weakness', '无')}</li>
-            <li><b>💡 建议：</b> {content_fb.get('suggestion', '无')}</li>
-        </ul>
-        <h3 style='background-color:#FFF3E0'>二、语言表达 (逐句精改)</h3>
-        """
+
+        # 模型返回的自由文本先转义，既防串改 HTML 结构，也避免 QTextEdit 解析出错
+        escape = html.escape
+
+        # 列表收集 + 最后一次 join，避免长修改列表下字符串 += 的 O(N^2) 拷贝
+        parts = [_FEEDBACK_HEADER.format(
+            total=scores.get('total', 0),
+            dim1=scores.get('dim1_score', 0),
+            dim2=scores.get('dim2_score', 0),
+            dim3=scores.get('dim3_score', 0),
+            weakness=escape(content_fb.get('weakness', '无')),
+            suggestion=escape(content_fb.get('suggestion', '无')))]
         corrections = lang_fb.get('sentence_corrections', [])
         if corrections:
             for idx, item in enumerate(corrections, 1):
-                html += f"""
-                <div style='margin-bottom:10px; border-bottom:1px dashed #ccc; padding-bottom:5px;'>
-                    <p><b>{idx}. 🔴 原句：</b> <span style='color:#555'>{item.get('original')}</span></p>
-                    <p><b>🟢 修改：</b> <span style='color:#2E7D32; font-weight:bold'>{item.get('revised')}</span></p>
-                    <p><b>📘 解析：</b> <span style='color:#1565C0'>{item.get('explanation')}</span></p>
-                </div>
-                """
+                parts.append(_CORRECTION_TEMPLATE.format(
+                    idx=idx,
+                    original=escape(item.get('original') or ''),
+                    revised=escape(item.get('revised') or ''),
+                    explanation=escape(item.get('explanation') or '')))
         else:
-            html += "<p>暂无具体修改建议。</p>"
-            
-        html += f"""
-        <h3 style='background-color:#E8F5E9'>三、结构与衔接</h3>
-        <p>{fb.get('structure', '无')}</p>
-        <hr>
-        <p><b>🌟 整体总结：</b> {fb.get('overall_summary', '')}</p>
-        """
-        self.text_feedback.setHtml(html)
+            parts.append("<p>暂无具体修改建议。</p>")
+
+        parts.append(_FEEDBACK_FOOTER.format(
+            structure=escape(fb.get('structure', '无')),
+            overall_summary=escape(fb.get('overall_summary', ''))))
+        self.text_feedback.setHtml("".join(parts))
 
     def export_to_word(self):
         if not self.results_store:
@@ -516,11 +832,22 @@ class EssayGraderApp(QMainWindow):
         if not save_path:
             return
 
+        from docx import Document
+        from docx.shared import Pt, RGBColor
+        from docx.enum.text import WD_ALIGN_PARAGRAPH
+        from docx.oxml.ns import qn
+
         doc = Document()
         style = doc.styles['Normal']
-        style.font.name = 'Times New Roman' 
-        style.element.rPr.rFonts.set(qn('w:eastAsia'), 'Microsoft YaHei') 
-        
+        style.font.name = 'Times New Roman'
+        style.element.rPr.rFonts.set(qn('w:eastAsia'), 'Microsoft YaHei')
+
+        # 颜色对象提到循环外，避免每条修改意见都重新构造
+        color_total = RGBColor(255, 0, 0)
+        color_original = RGBColor(100, 100, 100)
+        color_revised = RGBColor(0, 128, 0)
+        color_explain = RGBColor(0, 0, 255)
+
         for i in range(self.file_list.count()):
             item = self.file_list.item(i)
             file_path = item.data(Qt.UserRole)
@@ -541,22 +868,18 @@ class EssayGraderApp(QMainWindow):
             scores = data.get('scores', {})
             table = doc.add_table(rows=2, cols=4)
             table.style = 'Table Grid'
-            hdr_cells = table.rows[0].cells
-            hdr_cells[0].text = '维度'
-            hdr_cells[1].text = '内容要点'
-            hdr_cells[2].text = '语言表达'
-            hdr_cells[3].text = '结构衔接'
-            
-            row_cells = table.rows[1].cells
-            row_cells[0].text = '得分'
-            row_cells[1].text = str(scores.get('dim1_score', 0))
-            row_cells[2].text = str(scores.get('dim2_score', 0))
-            row_cells[3].text = str(scores.get('dim3_score', 0))
-            
+            # _cells 一次性取出全部单元格，免得每行每格都触发一次 XML 解析
+            cell_values = ['维度', '内容要点', '语言表达', '结构衔接',
+                           '得分', str(scores.get('dim1_score', 0)),
+                           str(scores.get('dim2_score', 0)),
+                           str(scores.get('dim3_score', 0))]
+            for cell, val in zip(table._cells, cell_values):
+                cell.text = val
+
             total_p = doc.add_paragraph()
             run = total_p.add_run(f"总分：{scores.get('total')}/15")
             run.bold = True
-            run.font.color.rgb = RGBColor(255, 0, 0)
+            run.font.color.rgb = color_total
             run.font.size = Pt(14)
 
             fb = data.get('feedback_detail', {})
@@ -573,17 +896,17 @@ class EssayGraderApp(QMainWindow):
                 for idx, cor in enumerate(corrections, 1):
                     p_group = doc.add_paragraph()
                     p_group.add_run(f"{idx}. 原句：").bold = True
-                    p_group.add_run(cor.get('original', '')).font.color.rgb = RGBColor(100, 100, 100)
-                    
+                    p_group.add_run(cor.get('original', '')).font.color.rgb = color_original
+
                     p_group = doc.add_paragraph()
                     p_group.add_run(f"   修改：").bold = True
                     run_revised = p_group.add_run(cor.get('revised', ''))
-                    run_revised.font.color.rgb = RGBColor(0, 128, 0)
+                    run_revised.font.color.rgb = color_revised
                     run_revised.bold = True
-                    
+
                     p_group = doc.add_paragraph()
                     p_group.add_run(f"   解析：").bold = True
-                    p_group.add_run(cor.get('explanation', '')).font.color.rgb = RGBColor(0, 0, 255)
+                    p_group.add_run(cor.get('explanation', '')).font.color.rgb = color_explain
                     doc.add_paragraph("") 
             else:
                 doc.add_paragraph("暂无具体的逐句修改建议。")